@@ -26,11 +26,11 @@ PAGES = {
     },
 }
 
-page_names = list(PAGES.keys())
+PAGE_NAMES = tuple(PAGES)
 
 selected_page = st.sidebar.radio(
     "Select tool:",
-    page_names,
+    PAGE_NAMES,
     format_func=lambda name: f"{PAGES[name]['icon']}  {name}",
 )
 
@@ -0,0 +1,117 @@
+# tabs/_http.py
+import asyncio
+import json
+import threading
+import time
+import streamlit as st
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    # orjson parses straight from bytes and is several times faster.
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+
+BITLY_API = "https://api-ssl.bitly.com/v4"
+TIMEOUT = 10
+POOL_SIZE = 32
+
+# Client-side rate limit, kept under Bitly's per-minute quota: at most
+# RATE_LIMIT requests in any RATE_PERIOD window. RATE_BURST is the bucket
+# size (requests that may go back-to-back before the steady refill rate
+# applies); concurrency is capped separately by POOL_SIZE.
+RATE_LIMIT = 100
+RATE_PERIOD = 60
+RATE_BURST = 20
+
+# Read the token once at import instead of on every request.
+AUTH_HEADERS = {"Authorization": f"Bearer {st.secrets['BITLY_TOKEN']}"}
+
+
+# ------------------------------------------------------------------
+#                     RATE LIMIT
+# ------------------------------------------------------------------
+
+class _RateLimiter:
+    """Process-wide token bucket shared by every thread and event loop.
+
+    Holds `burst` tokens and refills so that no `time_period` window sees
+    more than `max_rate` requests. Tokens are taken only when a request is
+    about to be sent — nothing is reserved ahead, so an abandoned batch
+    leaves no debt behind.
+    """
+
+    def __init__(self, max_rate: int, time_period: float, burst: int):
+        assert 0 < burst < max_rate, "burst must be below max_rate (the rest is refill)"
+
+        self._capacity = burst
+        self._tokens = float(burst)
+        self._refill_rate = (max_rate - burst) / time_period
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, headroom: int = 0) -> float:
+        """Take a token if more than `headroom` are free -> 0.0.
+
+        Otherwise take nothing and return the seconds until one would be.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._refill_rate)
+            self._updated = now
+
+            if self._tokens >= 1 + headroom:
+                self._tokens -= 1
+                return 0.0
+
+            return (1 + headroom - self._tokens) / self._refill_rate
+
+    def acquire(self):
+        """Block this thread until a token is taken."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, headroom: int = 0):
+        """Wait (without blocking the loop) until a token is taken."""
+        while True:
+            wait = self.try_acquire(headroom)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+rate_limiter = _RateLimiter(RATE_LIMIT, RATE_PERIOD, RATE_BURST)
+
+
+class _RateLimitedSession(requests.Session):
+    """requests.Session that takes a rate-limiter token before every call.
+
+    Single sync calls take tokens with no headroom, while bulk async
+    batches leave one spare, so these calls wait for the next token rather
+    than behind another session's batch.
+    """
+
+    def request(self, *args, **kwargs):
+        rate_limiter.acquire()
+        return super().request(*args, **kwargs)
+
+
+# ------------------------------------------------------------------
+#                     SHARED BITLY SESSION
+# ------------------------------------------------------------------
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """One keep-alive session for every Bitly call (reuses TCP+TLS)."""
+    session = _RateLimitedSession()
+    session.headers.update(AUTH_HEADERS)
+
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+
+    return session
@@ -0,0 +1,240 @@
+# tabs/bitly_async.py
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+import httpx
+
+from tabs._http import AUTH_HEADERS, BITLY_API, TIMEOUT, POOL_SIZE, json_loads, rate_limiter
+
+
+logger = logging.getLogger(__name__)
+
+# Bitlinks per page — the API maximum, so a group costs as few requests as possible.
+PAGE_SIZE = 100
+
+# How many times a 429 (rate limited) response is retried.
+MAX_RETRIES = 3
+
+
+# ------------------------------------------------------------------
+#                     CLIENT SESSION
+# ------------------------------------------------------------------
+
+class _BitlyClient:
+    """One HTTP/2 client per batch, with an in-flight cap; rate limited process-wide."""
+
+    def __init__(self):
+        # HTTP/2 multiplexes the whole batch over one TLS connection;
+        # retries cover transient connect failures (not HTTP errors).
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=3,
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+        self.http = httpx.AsyncClient(
+            transport=transport,
+            headers=AUTH_HEADERS,
+            # No pool timeout — queued requests may wait for a free slot.
+            timeout=httpx.Timeout(TIMEOUT, pool=None),
+        )
+        self.in_flight = asyncio.Semaphore(POOL_SIZE)
+
+    async def __aenter__(self) -> "_BitlyClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.http.aclose()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request under the limits, retrying 429s."""
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.in_flight:
+                # Bulk traffic leaves one token spare for single sync calls.
+                await rate_limiter.acquire_async(headroom=1)
+                resp = await self.http.request(method, url, **kwargs)
+
+            if resp.status_code != 429 or attempt == MAX_RETRIES:
+                return resp
+
+            delay = _retry_after(resp, default=2 ** attempt)
+            logger.warning("Bitly rate limit hit, retrying %s in %.1fs", url, delay)
+            await asyncio.sleep(delay)
+
+
+def _retry_after(resp: httpx.Response, default: float) -> float:
+    try:
+        return float(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return default
+
+
+async def _tracked(coro: Awaitable, on_done: Optional[Callable[[], None]]):
+    """Await `coro`, then notify `on_done` (used to drive progress bars)."""
+    result = await coro
+    if on_done:
+        on_done()
+    return result
+
+
+# ------------------------------------------------------------------
+#                     BITLINKS
+# ------------------------------------------------------------------
+
+async def _fetch_page(client: _BitlyClient, group_guid: str, page: int, created_after: Optional[int]):
+    """Request a single page of group bitlinks -> (data, error)."""
+    params = {"size": PAGE_SIZE, "page": page}
+    if created_after:
+        params["created_after"] = created_after
+
+    try:
+        resp = await client.request("GET", f"{BITLY_API}/groups/{group_guid}/bitlinks", params=params)
+    except httpx.HTTPError as e:
+        return None, f"Bitly API request failed: {e}"
+
+    if resp.status_code != 200:
+        return None, f"Bitly API error {resp.status_code}: {resp.text}"
+
+    return json_loads(resp.content), None
+
+
+async def fetch_all_bitlinks(group_guid: str, created_after: Optional[int] = None) -> Tuple[List[dict], Optional[str]]:
+    """Fetch every bitlink in the group; pages 2..N are requested concurrently."""
+    async with _BitlyClient() as client:
+        data, err = await _fetch_page(client, group_guid, 1, created_after)
+        if err:
+            return [], err
+
+        items = data.get("links", [])
+        bitlinks = list(items)
+
+        total = data.get("pagination", {}).get("total")
+
+        if total is None:
+            # No pagination metadata — fall back to walking pages one by one.
+            page = 1
+            while len(items) == PAGE_SIZE:
+                page += 1
+                data, err = await _fetch_page(client, group_guid, page, created_after)
+                if err:
+                    return [], err
+
+                items = data.get("links", [])
+                bitlinks.extend(items)
+
+            return bitlinks, None
+
+        last_page = -(-total // PAGE_SIZE)
+        pages = await asyncio.gather(
+            *(_fetch_page(client, group_guid, page, created_after) for page in range(2, last_page + 1))
+        )
+
+        for data, err in pages:
+            if err:
+                return [], err
+
+            bitlinks.extend(data.get("links", []))
+
+        return bitlinks, None
+
+
+# ------------------------------------------------------------------
+#                     CLICKS
+# ------------------------------------------------------------------
+
+async def _fetch_clicks(client: _BitlyClient, bitlink_id: str) -> Optional[int]:
+    """Total clicks for one bitlink, or None if the lookup failed."""
+    try:
+        resp = await client.request("GET", f"{BITLY_API}/bitlinks/{bitlink_id}/clicks/summary")
+    except httpx.HTTPError:
+        return None
+
+    if resp.status_code != 200:
+        return None
+
+    return json_loads(resp.content).get("total_clicks", 0)
+
+
+async def fetch_clicks_all(ids: Iterable[str], on_done: Optional[Callable[[], None]] = None) -> List[Optional[int]]:
+    """Fetch total clicks for every bitlink id (None for failures), as fast as the rate limit allows."""
+    async with _BitlyClient() as client:
+        return await asyncio.gather(*(_tracked(_fetch_clicks(client, bid), on_done) for bid in ids))
+
+
+# ------------------------------------------------------------------
+#                     SHORTEN + TITLE
+# ------------------------------------------------------------------
+
+async def shorten_with_bitly(
+    client: _BitlyClient,
+    long_url: str,
+    domain: Optional[str] = None,
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Step 1: Create Bitly short link -> (link, bitlink_id, error)."""
+    payload = {"long_url": long_url}
+    if domain:
+        payload["domain"] = domain
+
+    try:
+        resp = await client.request("POST", f"{BITLY_API}/shorten", json=payload)
+        if resp.status_code not in (200, 201):
+            return None, None, f"Bitly error {resp.status_code}: {resp.text}"
+
+        data = json_loads(resp.content)
+        return data.get("link"), data.get("id"), None
+
+    except Exception as e:
+        return None, None, str(e)
+
+
+async def update_bitly_title(client: _BitlyClient, bitlink_id: str, title: str) -> Optional[str]:
+    """Step 2: Update Bitly title via PATCH (`bitlink_id` as returned by /shorten)."""
+    payload = {"title": title}
+
+    try:
+        resp = await client.request("PATCH", f"{BITLY_API}/bitlinks/{bitlink_id}", json=payload)
+        if resp.status_code not in (200, 201):
+            return f"Title update error {resp.status_code}: {resp.text}"
+
+        return None
+
+    except Exception as e:
+        return f"Exception while setting title: {e}"
+
+
+async def _set_title(client: _BitlyClient, bitlink_id: Optional[str], title: str) -> Optional[str]:
+    """Phase 2 step for one URL — nothing to title if shortening failed."""
+    if not bitlink_id:
+        return None
+
+    return await update_bitly_title(client, bitlink_id, title)
+
+
+async def shorten_all(
+    items: Iterable[Tuple[str, str]],
+    domain: Optional[str] = None,
+    on_done: Optional[Callable[[], None]] = None,
+) -> List[Tuple[Optional[str], str]]:
+    """Shorten every (long_url, title) pair, then set every title -> [(short_url, error)].
+
+    Each phase runs all URLs concurrently, so the batch costs ~2 round-trips.
+    `on_done` fires twice per item (once per phase).
+    """
+    items = list(items)
+
+    async with _BitlyClient() as client:
+        shortened = await asyncio.gather(
+            *(_tracked(shorten_with_bitly(client, url, domain=domain), on_done) for url, _ in items)
+        )
+
+        title_errs = await asyncio.gather(
+            *(
+                _tracked(_set_title(client, bitlink_id, title), on_done)
+                for (_, bitlink_id, _), (_, title) in zip(shortened, items)
+            )
+        )
+
+    return [
+        (short_url, err or title_err or "")
+        for (short_url, _, err), title_err in zip(shortened, title_errs)
+    ]
@@ -1,96 +1,179 @@
 # tabs/bitly_stats.py
 import streamlit as st
-import requests
 import pandas as pd
+import io
 import time
-from urllib.parse import urlparse, parse_qs
-from typing import Optional
+import asyncio
+import re
+import threading
+from itertools import count
+from urllib.parse import unquote_plus
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from tabs import bitly_async
+from tabs._http import BITLY_API, TIMEOUT, POOL_SIZE, RATE_LIMIT, RATE_PERIOD, get_session, json_loads
+
+
+# Bitly responses are cached across reruns/sessions for this long (seconds).
+CACHE_TTL = 600
+
+# Most-clicked bitlinks requested from the group-level clicks endpoint. Kept
+# at the 100 the list endpoint accepts per page (no larger limit is documented
+# for this endpoint). Scoped to the date filter, a reply with fewer links than
+# this is complete; otherwise links it misses fall back to per-link lookups.
+GROUP_CLICKS_SIZE = 100
+
+# Date filter choices -> days back (None = all time).
+DATE_RANGES = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "All time": None}
 
 
 # =====================================================================
 #                        BITLY API HELPERS
 # =====================================================================
 
-def get_group_guid() -> Optional[str]:
-    """Fetch the Bitly group GUID (required for listing links)."""
-    token = st.secrets["BITLY_TOKEN"]
-    headers = {"Authorization": f"Bearer {token}"}
+class BitlyError(Exception):
+    """A Bitly call failed. Raised (never returned) so st.cache_data won't cache it."""
 
-    resp = requests.get("https://api-ssl.bitly.com/v4/groups", headers=headers)
+
+def _get(url: str, **params) -> requests.Response:
+    try:
+        return get_session().get(url, params=params or None, timeout=TIMEOUT)
+    except requests.RequestException as e:
+        raise BitlyError(str(e)) from e
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_group_guid() -> str:
+    """Fetch the Bitly group GUID (required for listing links)."""
+    resp = _get(f"{BITLY_API}/groups")
 
     if resp.status_code != 200:
-        st.error(f"❌ Could not load Bitly groups: {resp.status_code} — {resp.text}")
-        return None
+        raise BitlyError(f"Could not load Bitly groups: {resp.status_code} — {resp.text}")
 
-    data = resp.json()
+    data = json_loads(resp.content)
     groups = data.get("groups", [])
     if not groups:
-        st.error("❌ No Bitly groups found.")
-        return None
+        raise BitlyError("No Bitly groups found.")
 
     return groups[0]["guid"]
 
 
-def get_all_bitlinks(group_guid: str, created_after: Optional[int] = None):
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_all_bitlinks(group_guid: str, created_after: Optional[int] = None) -> List[dict]:
     """Fetch links from Bitly, optionally limited by creation time."""
-    token = st.secrets["BITLY_TOKEN"]
-    headers = {"Authorization": f"Bearer {token}"}
+    bitlinks, err = asyncio.run(bitly_async.fetch_all_bitlinks(group_guid, created_after))
 
-    bitlinks = []
-    size = 50
-    page = 1
+    if err:
+        raise BitlyError(err)
 
-    while True:
-        params = f"?size={size}&page={page}"
-        if created_after:
-            params += f"&created_after={created_after}"
+    return bitlinks
 
-        url = f"https://api-ssl.bitly.com/v4/groups/{group_guid}/bitlinks{params}"
 
-        resp = requests.get(url, headers=headers)
-        if resp.status_code != 200:
-            st.error(f"❌ Bitly API error {resp.status_code}: {resp.text}")
-            return []
+@st.cache_resource
+def _clicks_cache() -> Dict[str, Tuple[float, int]]:
+    """Process-wide {bitlink_id: (fetched_at, clicks)} — successful lookups only."""
+    return {}
 
-        data = resp.json()
-        items = data.get("links", [])
-        bitlinks.extend(items)
 
-        if len(items) < size:  # no more pages
-            break
+# Guards _clicks_cache(): sessions run in parallel script threads.
+_clicks_lock = threading.Lock()
 
-        page += 1
 
-    return bitlinks
+def get_cached_clicks(bitlink_ids: Sequence[str]) -> Dict[str, int]:
+    """Click totals already cached (and fresh) for any of these ids."""
+    cache = _clicks_cache()
+    now = time.monotonic()
+
+    clicks = {}
+    with _clicks_lock:
+        for bid in bitlink_ids:
+            hit = cache.get(bid)
+            if hit and now - hit[0] < CACHE_TTL:
+                clicks[bid] = hit[1]
+
+    return clicks
+
+
+def fetch_clicks(
+    bitlink_ids: Sequence[str],
+    on_done: Optional[Callable[[], None]] = None,
+) -> Dict[str, Optional[int]]:
+    """Fetch total clicks per Bitly link concurrently -> {bitlink_id: clicks or None}.
+
+    Successful counts are cached per id for CACHE_TTL; failed lookups (None)
+    are not, so they are retried on the next load.
+    """
+    fetched = asyncio.run(bitly_async.fetch_clicks_all(bitlink_ids, on_done=on_done))
+    cache = _clicks_cache()
+    now = time.monotonic()
+
+    with _clicks_lock:
+        # Prune expired entries so the cache doesn't grow forever.
+        for bid in [bid for bid, (fetched_at, _) in cache.items() if now - fetched_at >= CACHE_TTL]:
+            del cache[bid]
+
+        for bid, n in zip(bitlink_ids, fetched):
+            if n is not None:
+                cache[bid] = (now, n)
+
+    return dict(zip(bitlink_ids, fetched))
 
 
-def get_clicks(bitlink_id: str) -> int:
-    """Fetch total clicks for a Bitly link."""
-    token = st.secrets["BITLY_TOKEN"]
-    headers = {"Authorization": f"Bearer {token}"}
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_group_clicks(group_guid: str, units: int = -1) -> Tuple[Dict[str, int], bool]:
+    """Fetch the group's most-clicked bitlinks over the last `units` days in one call.
 
-    url = f"https://api-ssl.bitly.com/v4/bitlinks/{bitlink_id}/clicks/summary"
-    resp = requests.get(url, headers=headers)
+    Returns ({bitlink_id: clicks}, complete). `complete` means fewer than
+    GROUP_CLICKS_SIZE links came back, so any link not listed had no clicks
+    in the window.
+    """
+    resp = _get(
+        f"{BITLY_API}/groups/{group_guid}/bitlinks/clicks",
+        unit="day", units=units, size=GROUP_CLICKS_SIZE,
+    )
 
     if resp.status_code != 200:
-        return 0
+        raise BitlyError(f"Group click totals unavailable ({resp.status_code})")
+
+    sorted_links = json_loads(resp.content).get("sorted_links", [])
+    clicks = {item["id"]: item.get("clicks", 0) for item in sorted_links}
+
+    return clicks, len(sorted_links) < GROUP_CLICKS_SIZE
 
-    return resp.json().get("total_clicks", 0)
+
+def clear_cache():
+    """Drop every cached Bitly response so the next load hits the API."""
+    get_group_guid.clear()
+    get_all_bitlinks.clear()
+    _clicks_cache().clear()
+    get_group_clicks.clear()
 
 
 # =====================================================================
 #                        UTM PARSING
 # =====================================================================
 
+_UTM_RE = re.compile(r"(?:^|&)(utm_(?:source|medium|campaign))=([^&]*)")
+
+
 def parse_utm_params(long_url: str):
-    parsed = urlparse(long_url)
-    query = parse_qs(parsed.query)
+    utm = {"utm_source": "", "utm_medium": "", "utm_campaign": ""}
 
-    return {
-        "utm_source": query.get("utm_source", [""])[0],
-        "utm_medium": query.get("utm_medium", [""])[0],
-        "utm_campaign": query.get("utm_campaign", [""])[0],
-    }
+    # Scan only the query string: after the first '?', before any '#fragment'.
+    query = long_url.partition("#")[0].partition("?")[2]
+
+    for key, value in _UTM_RE.findall(query):
+        if utm[key] or not value:
+            continue  # first non-empty value wins, like parse_qs()[0]
+
+        if "%" in value or "+" in value:
+            value = unquote_plus(value)
+
+        utm[key] = value
+
+    return utm
 
 
 # =====================================================================
@@ -108,19 +191,19 @@ def render():
     # ----------------- Date Range Filter -----------------
     date_choice = st.selectbox(
         "Fetch links from:",
-        ["Last 7 days", "Last 30 days", "Last 90 days", "All time"]
+        list(DATE_RANGES)
     )
+    days = DATE_RANGES[date_choice]
+
+    # Rounded down to the hour so repeated loads hit the same cache entry.
+    now = int(time.time()) // 3600 * 3600
 
-    now = int(time.time())
+    created_after = now - days * 24 * 3600 if days else None
 
-    if date_choice == "Last 7 days":
-        created_after = now - 7 * 24 * 3600
-    elif date_choice == "Last 30 days":
-        created_after = now - 30 * 24 * 3600
-    elif date_choice == "Last 90 days":
-        created_after = now - 90 * 24 * 3600
-    else:
-        created_after = None
+    # Click window for the group totals. Every click on a link created after
+    # `created_after` falls in it, so it equals that link's all-time total;
+    # two spare days cover day-bucket alignment.
+    click_units = days + 2 if days else -1
 
     # ----------------- Pre-fetch Filters -----------------
     st.subheader("⚡ Pre-filter by UTM TEXT (before fetching clicks — VERY fast)")
@@ -129,65 +212,124 @@ def render():
     prefilter_medium = st.text_input("Must contain utm_medium text (optional)")
     prefilter_campaign = st.text_input("Must contain utm_campaign text (optional)")
 
+    # Substrings every kept long_url must contain (only the filters that are set).
+    needles = tuple(
+        f"{key}={text}"
+        for key, text in (
+            ("utm_source", prefilter_source),
+            ("utm_medium", prefilter_medium),
+            ("utm_campaign", prefilter_campaign),
+        )
+        if text
+    )
+
     st.markdown("---")
 
     # ----------------- FETCH BUTTON -----------------
-    if st.button("Load Bitly Stats", type="primary"):
+    col_load, col_refresh = st.columns([1, 4])
+    with col_load:
+        load = st.button("Load Bitly Stats", type="primary")
+    with col_refresh:
+        refresh = st.button("🔄 Refresh", help="Ignore cached results and fetch live data from Bitly.")
+
+    if refresh:
+        clear_cache()
+
+    if load or refresh:
         with st.spinner("Fetching data from Bitly…"):
 
-            group_guid = get_group_guid()
-            if not group_guid:
+            try:
+                group_guid = get_group_guid()
+                links = get_all_bitlinks(group_guid, created_after)
+            except BitlyError as e:
+                st.error(f"❌ {e}")
                 return
 
-            links = get_all_bitlinks(group_guid, created_after)
-
             if not links:
                 st.warning("No Bitly links found.")
                 return
 
-            rows = []
-
-            for item in links:
-                bitlink = item.get("link")
-                long_url = item.get("long_url", "")
-                title = item.get("title") or "Untitled"
-
-                # ------------------------------------------------------------
-                # PRE-FETCH FILTERS (skip early for speed)
-                # ------------------------------------------------------------
-                if prefilter_source and f"utm_source={prefilter_source}" not in long_url:
-                    continue
-                if prefilter_medium and f"utm_medium={prefilter_medium}" not in long_url:
-                    continue
-                if prefilter_campaign and f"utm_campaign={prefilter_campaign}" not in long_url:
-                    continue
-
-                # ------------------------------------------------------------
-                # PARSE UTM
-                # ------------------------------------------------------------
-                utm = parse_utm_params(long_url)
+            links_df = pd.DataFrame(links).reindex(columns=["id", "link", "long_url", "title"])
+            long_urls = links_df["long_url"].fillna("")
 
-                # ------------------------------------------------------------
-                # CLICK STAT FETCH (slow — so we avoid it for skipped items)
-                # ------------------------------------------------------------
-                bitlink_id = bitlink.replace("https://", "")
-                clicks = get_clicks(bitlink_id)
+            # ------------------------------------------------------------
+            # PRE-FETCH FILTERS (one vectorized mask, skip early for speed)
+            # ------------------------------------------------------------
+            survivors = links_df
+            if needles:
+                mask = pd.Series(True, index=links_df.index)
+                for needle in needles:
+                    mask &= long_urls.str.contains(needle, regex=False)
 
-                rows.append({
-                    "Title": title,
-                    "Bitly Link": bitlink,
-                    "UTM URL": long_url,
-                    "utm_source": utm["utm_source"],
-                    "utm_medium": utm["utm_medium"],
-                    "utm_campaign": utm["utm_campaign"],
-                    "Clicks": clicks,
-                })
+                survivors = links_df.loc[mask]
+                long_urls = long_urls.loc[mask]
 
-        if not rows:
-            st.warning("No results match your filters.")
-            return
+            if survivors.empty:
+                st.warning("No results match your filters.")
+                return
 
-        df = pd.DataFrame(rows)
+            # Columnar result: one list per output column, no per-row dicts.
+            cols = {
+                "Title": survivors["title"].fillna("").replace("", "Untitled").tolist(),
+                "Bitly Link": survivors["link"].tolist(),
+                "UTM URL": long_urls.tolist(),
+                "utm_source": [],
+                "utm_medium": [],
+                "utm_campaign": [],
+            }
+
+            # ------------------------------------------------------------
+            # PARSE UTM
+            # ------------------------------------------------------------
+            for long_url in cols["UTM URL"]:
+                utm = parse_utm_params(long_url)
+                cols["utm_source"].append(utm["utm_source"])
+                cols["utm_medium"].append(utm["utm_medium"])
+                cols["utm_campaign"].append(utm["utm_campaign"])
+
+            # ------------------------------------------------------------
+            # CLICK STATS (one group-level call, per-link only for misses)
+            # ------------------------------------------------------------
+            ids = tuple(survivors["id"])
+            try:
+                clicks, complete = get_group_clicks(group_guid, click_units)
+            except BitlyError as e:
+                st.warning(f"⚠️ {e} — falling back to per-link lookups, this may be slow.")
+                clicks, complete = {}, False
+
+            if complete:
+                # Every link clicked in the window is listed; the rest had none.
+                clicks = {bid: clicks.get(bid, 0) for bid in ids}
+
+            missing = [bid for bid in ids if bid not in clicks]
+            clicks.update(get_cached_clicks(missing))
+            to_fetch = [bid for bid in missing if bid not in clicks]
+
+            if to_fetch:
+                st.info(
+                    f"⏳ Looking up clicks for {len(to_fetch)} link(s) one by one — "
+                    f"rate limited to {RATE_LIMIT} per {RATE_PERIOD}s."
+                )
+                progress = st.progress(0)
+                completed = count(1)
+
+                clicks.update(fetch_clicks(
+                    to_fetch,
+                    on_done=lambda: progress.progress(next(completed) / len(to_fetch)),
+                ))
+                progress.empty()
+
+            cols["Clicks"] = [clicks[bid] for bid in ids]
+
+            failed = sum(n is None for n in cols["Clicks"])
+            if failed:
+                st.warning(
+                    f"⚠️ Could not load clicks for {failed} link(s) — shown blank, "
+                    "retried on the next load."
+                )
+
+            # Nullable Int32 so failed lookups stay blank instead of a fake 0.
+            df = pd.DataFrame(cols, copy=False).astype({"Clicks": "Int32"})
 
         # ----------------- Sorting -----------------
         df = df.sort_values(
@@ -196,11 +338,22 @@ def render():
         )
 
         st.subheader("📄 Results")
+
+        # Batch settings, shown so page size / rate limit can be tuned.
+        st.caption(
+            f"{len(links)} bitlinks fetched at {bitly_async.PAGE_SIZE} per page · "
+            f"{len(to_fetch)} per-link click lookups sent to Bitly, "
+            f"{len(missing) - len(to_fetch)} served from cache "
+            f"({RATE_LIMIT} per {RATE_PERIOD}s, {POOL_SIZE} in flight)"
+        )
         st.dataframe(df, use_container_width=True)
 
+        csv_buf = io.BytesIO()
+        df.to_csv(csv_buf, index=False, encoding="utf-8", lineterminator="\n")
+
         st.download_button(
             "Download Stats as CSV",
-            data=df.to_csv(index=False).encode("utf-8"),
+            data=csv_buf.getvalue(),
             file_name="bitly_stats.csv",
             mime="text/csv"
         )
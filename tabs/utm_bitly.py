@@ -1,9 +1,24 @@
 # tabs/utm_bitly.py
 import streamlit as st
-import requests
 import pandas as pd
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
-from typing import Optional, Tuple
+import io
+import asyncio
+from itertools import count
+from urllib.parse import urlparse, parse_qsl, quote_plus, urlencode, urlunparse
+
+from tabs import bitly_async
+
+
+_DASH_TO_SPACE = str.maketrans("-", " ")
+
+_HARDCODED_LABELS = (
+    "📌 Розробка Shopify-магазину для дропшипінгу «під ключ»",
+    "📌 Індивідуальна розробка Shopify-магазину для вашого бренду",
+    "📌 Підключення Shopify Payments, PayPal, Stripe",
+    "📌 Рекламні креативи для тесту продукту",
+    "📌 Особистий агент з Китаю",
+    "📌 Voodoo Product Hunter — 15 потенційних winner-товарів кожного місяця",
+)
 
 
 # ------------------------------------------------------------------
@@ -21,6 +36,20 @@ def build_utm_url(
     if not base_url:
         return ""
 
+    # Fast path: no existing query/fragment to merge, so just append.
+    if "?" not in base_url and "#" not in base_url:
+        parts = [
+            f"{k}={quote_plus(v)}"
+            for k, v in (
+                ("utm_source", utm_source),
+                ("utm_medium", utm_medium),
+                ("utm_campaign", utm_campaign),
+                ("utm_term", utm_term),
+            )
+            if v
+        ]
+        return f"{base_url}?{'&'.join(parts)}" if parts else base_url
+
     parsed = urlparse(base_url)
     query_params = dict(parse_qsl(parsed.query, keep_blank_values=True))
 
@@ -40,71 +69,6 @@ def build_utm_url(
     return urlunparse(new_parsed)
 
 
-# ------------------------------------------------------------------
-#                     BITLY SHORTENER
-# ------------------------------------------------------------------
-
-def shorten_with_bitly(long_url: str, domain: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
-    """Step 1: Create Bitly short link."""
-    bitly_token = st.secrets["BITLY_TOKEN"]
-
-    headers = {
-        "Authorization": f"Bearer {bitly_token}",
-        "Content-Type": "application/json",
-    }
-
-    payload = {"long_url": long_url}
-    if domain:
-        payload["domain"] = domain
-
-    try:
-        resp = requests.post(
-            "https://api-ssl.bitly.com/v4/shorten",
-            headers=headers,
-            json=payload,
-            timeout=10,
-        )
-
-        if resp.status_code not in (200, 201):
-            return None, f"Bitly error {resp.status_code}: {resp.text}"
-
-        data = resp.json()
-        return data.get("link"), None
-
-    except Exception as e:
-        return None, str(e)
-
-
-def update_bitly_title(bitlink: str, title: str) -> Optional[str]:
-    """Step 2: Update Bitly title via PATCH."""
-    token = st.secrets["BITLY_TOKEN"]
-
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
-
-    payload = {"title": title}
-
-    bitlink_id = bitlink.replace("https://", "")
-
-    try:
-        resp = requests.patch(
-            f"https://api-ssl.bitly.com/v4/bitlinks/{bitlink_id}",
-            headers=headers,
-            json=payload,
-            timeout=10,
-        )
-
-        if resp.status_code not in (200, 201):
-            return f"Title update error {resp.status_code}: {resp.text}"
-
-        return None
-
-    except Exception as e:
-        return f"Exception while setting title: {e}"
-
-
 # ------------------------------------------------------------------
 #                         UI RENDER
 # ------------------------------------------------------------------
@@ -140,15 +104,14 @@ def render():
             st.warning("Please paste URLs.")
             return
 
-        results = []
-        progress = st.progress(0)
+        jobs = []
 
         for i, url in enumerate(urls):
             # --------------------------------------------
             # Determine human-readable name from URL
             # --------------------------------------------
             parsed = urlparse(url)
-            slug = parsed.path.strip("/").split("/")[0].replace("-", " ").title()
+            slug = parsed.path.strip("/").partition("/")[0].translate(_DASH_TO_SPACE).title()
             readable_name = f"Розробка Shopify-магазину" if i == 0 else slug or parsed.netloc
 
             # --------------------------------------------
@@ -162,25 +125,30 @@ def render():
                 utm_term=utm_term,
             )
 
-            # --------------------------------------------
-            # Shorten
-            # --------------------------------------------
-            short_url, err = shorten_with_bitly(utm_url, domain=bitly_domain or None)
+            jobs.append((utm_url, f"{readable_name} — {utm_campaign}"))
+
+        # --------------------------------------------
+        # Shorten all, then set all titles (two concurrent phases)
+        # --------------------------------------------
+        progress = st.progress(0)
+        completed = count(1)
+        steps = 2 * len(jobs)
 
-            title_err = ""
-            if short_url:
-                final_title = f"{readable_name} — {utm_campaign}"
-                title_err = update_bitly_title(short_url, final_title) or ""
+        shortened = asyncio.run(bitly_async.shorten_all(
+            jobs,
+            domain=bitly_domain or None,
+            on_done=lambda: progress.progress(next(completed) / steps),
+        ))
 
+        results = []
+        for url, (utm_url, _), (short_url, err) in zip(urls, jobs, shortened):
             results.append({
                 "Original URL": url,
                 "UTM URL": utm_url,
                 "Short URL": short_url if short_url else "",
-                "Error": err or title_err,
+                "Error": err,
             })
 
-            progress.progress((i + 1) / len(urls))
-
         df = pd.DataFrame(results)
 
         st.success("Done!")
@@ -196,17 +164,8 @@ def render():
         # ---------- Hardcoded Final Output Block ----------
         st.markdown("### 📌 Ready-to-copy formatted output")
 
-        HARDCODED_LABELS = [
-            "📌 Розробка Shopify-магазину для дропшипінгу «під ключ»",
-            "📌 Індивідуальна розробка Shopify-магазину для вашого бренду",
-            "📌 Підключення Shopify Payments, PayPal, Stripe",
-            "📌 Рекламні креативи для тесту продукту",
-            "📌 Особистий агент з Китаю",
-            "📌 Voodoo Product Hunter — 15 потенційних winner-товарів кожного місяця"
-        ]
-
         final_output_lines = []
-        for label, row in zip(HARDCODED_LABELS, results):
+        for label, row in zip(_HARDCODED_LABELS, results):
             short = row["Short URL"]
             final_output_lines.append(f"{label} - {short}")
 
@@ -215,9 +174,12 @@ def render():
         # -----------------------------------------------------
         # CSV Download
         # -----------------------------------------------------
+        csv_buf = io.BytesIO()
+        df.to_csv(csv_buf, index=False, encoding="utf-8", lineterminator="\n")
+
         st.download_button(
             "Download results as CSV",
-            data=df.to_csv(index=False).encode("utf-8"),
+            data=csv_buf.getvalue(),
             file_name="utm_bitly_results.csv",
             mime="text/csv"
         )